@@ -1,15 +1,35 @@
-from fastapi import FastAPI
+import os
 
-app = FastAPI()
+from fastapi import FastAPI, Response
 
-@app.get("/")
+api = FastAPI()
+
+# Constant bodies, serialized once at import instead of on every request
+ROOT_RESPONSE = Response(content=b'{"message":"Hello World"}', media_type="application/json")
+HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
+
+@api.get("/")
 def read_root():
-    return {"message": "Hello World"}
+    return ROOT_RESPONSE
 
-@app.get("/health")
+@api.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return HEALTH_RESPONSE
+
+HEALTH_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(HEALTH_RESPONSE.body)).encode()),
+]
+
+async def app(scope, receive, send):
+    """ASGI entry point answering /health probes before FastAPI routing"""
+    if scope["type"] == "http" and scope["path"] == "/health" and scope["method"] in ("GET", "HEAD"):
+        await send({"type": "http.response.start", "status": 200, "headers": HEALTH_HEADERS})
+        await send({"type": "http.response.body", "body": HEALTH_RESPONSE.body})
+        return
+    await api(scope, receive, send)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=os.cpu_count() or 1,
+                loop="uvloop", http="httptools", access_log=False)
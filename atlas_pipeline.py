@@ -1,92 +1,305 @@
+import argparse
 import subprocess
+import http.client
 import time
 import logging
 import os
 import sys
 import json
-from kubernetes import client, config
+import threading
+import urllib3
+import yaml
+from kubernetes import client, config, utils, watch
 from kubernetes.client.rest import ApiException
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cap on captured command output; anything beyond it is read and discarded
+MAX_CAPTURE_BYTES = 64 * 1024
+
 # Define helper functions for executing shell commands
-def run_command(command, timeout=300):
-    """Run a shell command and return the output"""
+def run_command(argv, timeout=300, check=True, capture=False, env=None):
+    """Run a command given as an argv list
+
+    Output goes straight to the terminal unless capture=True, in which case
+    stdout is read in fixed-size chunks (keeping at most MAX_CAPTURE_BYTES)
+    and returned.
+    With check=False a failing command returns None instead of exiting.
+    """
+    if not capture:
+        try:
+            subprocess.run(argv, check=True, timeout=timeout, env=env)
+            return ""
+        except subprocess.CalledProcessError as e:
+            if not check:
+                return None
+            logger.error(f"Command {' '.join(argv)} exited with status {e.returncode}")
+            sys.exit(1)
+        except subprocess.TimeoutExpired:
+            if not check:
+                return None
+            logger.error(f"Command {' '.join(argv)} timed out after {timeout}s")
+            sys.exit(1)
+        except OSError as e:
+            if not check:
+                return None
+            logger.error(f"Command {' '.join(argv)} could not be started: {e}")
+            sys.exit(1)
+
+    try:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, env=env)
+    except OSError as e:
+        if not check:
+            return None
+        logger.error(f"Command {' '.join(argv)} could not be started: {e}")
+        sys.exit(1)
+    timed_out = threading.Event()
+
+    def kill_on_timeout():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill_on_timeout)
+    timer.start()
+    chunks, size = [], 0
     try:
-        result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
-        return result.stdout.decode('utf-8')
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Command failed with error: {e.stderr.decode('utf-8')}")
+        # Bounded reads keep memory flat even for output without newlines
+        for chunk in iter(lambda: proc.stdout.read(8192), b""):
+            if size < MAX_CAPTURE_BYTES:
+                chunks.append(chunk[:MAX_CAPTURE_BYTES - size])
+                size += len(chunks[-1])
+        returncode = proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    if returncode != 0:
+        if not check:
+            return None
+        if timed_out.is_set():
+            logger.error(f"Command {' '.join(argv)} timed out after {timeout}s")
+        else:
+            logger.error(f"Command {' '.join(argv)} exited with status {returncode}")
         sys.exit(1)
+    # The cap may split a multi-byte character
+    return b"".join(chunks).decode('utf-8', errors='replace')
+
+def minikube_status():
+    """Return `minikube status -o json` as a dict
+
+    minikube exits non-zero when the cluster is stopped or missing; that
+    (and any unparseable output) yields an empty dict.
+    """
+    output = run_command(["minikube", "status", "-o", "json"], capture=True, check=False)
+    try:
+        status = json.loads(output or "{}")
+    except json.JSONDecodeError:
+        return {}
+    # Multi-node profiles report a list with the control plane first
+    if isinstance(status, list):
+        status = status[0] if status else {}
+    return status
 
 def start_minikube():
     """Ensure Minikube is running"""
     try:
         logger.info("Checking if Minikube is running...")
-        minikube_status = run_command("minikube status")
-        if "Running" not in minikube_status:
+        if minikube_status().get("Host") != "Running":
             logger.info("Minikube not running; starting with Docker driver...")
-            run_command("minikube start --driver=docker")
+            run_command(["minikube", "start", "--driver=docker"])
         else:
             logger.info("Minikube is already running.")
     except Exception as e:
         logger.error(f"Error starting Minikube: {str(e)}")
         sys.exit(1)
 
-def create_namespace(namespace="atlas"):
+def minikube_ip():
+    """Return the Minikube IP, preferring $MINIKUBE_IP over shelling out"""
+    return os.environ.get("MINIKUBE_IP") or run_command(["minikube", "ip"], capture=True).strip()
+
+def build_in_minikube(image="atlas-app:latest"):
+    """Build the app image directly inside Minikube's Docker daemon"""
+    logger.info(f"Building image '{image}' inside Minikube...")
+    docker_env = run_command(["minikube", "docker-env", "--shell", "none"], capture=True)
+    env = dict(os.environ)
+    for line in docker_env.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            env[key.strip()] = value.strip()
+    run_command(["docker", "build", "-t", image, "."], timeout=1800, env=env)
+
+def mark_for_restart(docs):
+    """Stamp Deployment pod templates so a rebuilt image with the same tag rolls out
+
+    Same annotation `kubectl rollout restart` sets.
+    """
+    restarted_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    for doc in docs:
+        if doc["kind"] == "Deployment":
+            template_meta = doc["spec"]["template"].setdefault("metadata", {})
+            template_meta.setdefault("annotations", {})["kubectl.kubernetes.io/restartedAt"] = restarted_at
+
+# Patch methods used when an object from a manifest already exists
+PATCHERS = {
+    "Deployment": (client.AppsV1Api, "patch_namespaced_deployment"),
+    "Service": (client.CoreV1Api, "patch_namespaced_service"),
+}
+
+def create_namespace(api_client, namespace="atlas"):
     """Create a Kubernetes namespace"""
     try:
         logger.info(f"Creating namespace '{namespace}'...")
-        run_command(f"kubectl create namespace {namespace} --dry-run=client -o yaml | kubectl apply -f -")
-    except ApiException as e:
+        client.CoreV1Api(api_client).create_namespace(
+            client.V1Namespace(metadata=client.V1ObjectMeta(name=namespace))
+        )
+    except urllib3.exceptions.HTTPError as e:
         logger.error(f"Error creating namespace: {e}")
         sys.exit(1)
+    except ApiException as e:
+        if e.status != 409:
+            logger.error(f"Error creating namespace: {e}")
+            sys.exit(1)
+        logger.info(f"Namespace '{namespace}' already exists.")
 
-def apply_kubernetes_manifest(manifest_path):
-    """Apply the Kubernetes manifest"""
+def apply_manifest_object(api_client, doc, namespace="atlas"):
+    """Create one manifest object, patching it in place if it already exists"""
     try:
-        logger.info(f"Applying manifest from {manifest_path}...")
-        run_command(f"kubectl apply -f {manifest_path}")
-    except ApiException as e:
-        logger.error(f"Error applying manifest: {e}")
+        utils.create_from_dict(api_client, doc, namespace=namespace)
+    except utils.FailToCreateError as e:
+        if any(exc.status != 409 for exc in e.api_exceptions) or doc["kind"] not in PATCHERS:
+            raise
+        api_class, method = PATCHERS[doc["kind"]]
+        getattr(api_class(api_client), method)(
+            doc["metadata"]["name"], doc["metadata"].get("namespace", namespace), doc
+        )
+
+def load_manifests(manifest_paths):
+    """Parse and sanity-check the manifests without touching the cluster"""
+    docs = []
+    try:
+        for manifest_path in manifest_paths:
+            with open(manifest_path) as f:
+                for doc in yaml.safe_load_all(f):
+                    if not doc:
+                        continue
+                    if not doc.get("apiVersion") or not doc.get("kind") or not doc.get("metadata", {}).get("name"):
+                        raise ValueError(f"{manifest_path}: object missing apiVersion, kind or metadata.name")
+                    docs.append(doc)
+    except (OSError, yaml.YAMLError, ValueError) as e:
+        logger.error(f"Invalid manifest: {e}")
         sys.exit(1)
+    return docs
+
+def apply_kubernetes_manifests(api_client, docs, namespace="atlas"):
+    """Apply the parsed manifest objects through the API client"""
+    try:
+        logger.info(f"Applying {len(docs)} manifest objects...")
+        for doc in docs:
+            apply_manifest_object(api_client, doc, namespace)
+    except (ApiException, utils.FailToCreateError, urllib3.exceptions.HTTPError) as e:
+        logger.error(f"Error applying manifests: {e}")
+        sys.exit(1)
+
+def deployment_rolled_out(deployment):
+    """Mirror `kubectl rollout status`: the latest spec is fully rolled out and Available"""
+    status = deployment.status
+    updated = status.updated_replicas or 0
+    conditions = status.conditions or []
+    return (
+        (status.observed_generation or 0) >= deployment.metadata.generation
+        and updated == deployment.spec.replicas
+        and (status.available_replicas or 0) == updated
+        and any(c.type == "Available" and c.status == "True" for c in conditions)
+    )
 
-def check_service_status(service_name, namespace="atlas", retries=5, delay=10):
-    """Check the status of the service"""
+def check_service_status(api_client, service_name, namespace="atlas", deployment_name="atlas-deployment", deadline=60):
+    """Wait for the service to exist and its deployment to finish rolling out"""
     try:
-        for attempt in range(retries):
-            logger.info(f"Checking status of service '{service_name}' (attempt {attempt + 1}/{retries})...")
-            service_status = run_command(f"kubectl get svc {service_name} -n {namespace}")
-            if service_status:
+        logger.info(f"Checking status of service '{service_name}'...")
+        client.CoreV1Api(api_client).read_namespaced_service(service_name, namespace)
+        apps_v1 = client.AppsV1Api(api_client)
+        w = watch.Watch()
+        for event in w.stream(apps_v1.list_namespaced_deployment, namespace,
+                              field_selector=f"metadata.name={deployment_name}", timeout_seconds=deadline,
+                              _request_timeout=deadline + 5):
+            if deployment_rolled_out(event["object"]):
+                w.stop()
                 logger.info(f"Service {service_name} is ready.")
                 return True
-            time.sleep(delay)
-        logger.error(f"Service {service_name} is not available after {retries} attempts.")
+        logger.error(f"Service {service_name} is not available after {deadline}s.")
         return False
-    except ApiException as e:
+    except urllib3.exceptions.ReadTimeoutError:
+        # The watch stalled past _request_timeout without the apiserver closing it
+        logger.error(f"Service {service_name} is not available after {deadline}s (watch timed out).")
+        return False
+    except (ApiException, urllib3.exceptions.HTTPError) as e:
         logger.error(f"Error checking service status: {e}")
         return False
 
+def check_health(host, port=30080, path="/health", initial=0.2, max_delay=5.0, deadline=60.0, timeout=3.0):
+    """Probe the app's health endpoint over one reused keep-alive connection
+
+    Each connect and read is bounded by `timeout` seconds, so a silently
+    dropped connection costs one timeout rather than the OS TCP default.
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        delay = initial
+        end = time.monotonic() + deadline
+        while time.monotonic() < end:
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    logger.info(f"Health check at http://{host}:{port}{path} passed.")
+                    return True
+                logger.info(f"Health check returned HTTP {response.status}; retrying...")
+            except (OSError, http.client.HTTPException) as e:
+                logger.info(f"Health check failed ({e}); retrying...")
+                # Drop the broken socket; the next request reconnects on the same object
+                conn.close()
+            time.sleep(min(delay, max(end - time.monotonic(), 0)))
+            delay = min(delay * 1.5, max_delay)
+        logger.error(f"Health check at http://{host}:{port}{path} did not pass after {deadline:.0f}s.")
+        return False
+    finally:
+        conn.close()
+
 def main():
-    # Initialize Minikube
-    start_minikube()
+    parser = argparse.ArgumentParser(description="Deploy the atlas app to Minikube")
+    parser.add_argument("--build", action="store_true",
+                        help="build the image inside Minikube's Docker daemon before deploying")
+    args = parser.parse_args()
 
     # Set the namespace and manifest path
     namespace = "atlas"
     deployment_manifest = "k8s/atlas-deployment.yaml"
     service_manifest = "k8s/atlas-service-nodeport.yaml"
 
+    # Validate the manifests locally before paying for a Minikube start
+    docs = load_manifests([deployment_manifest, service_manifest])
+
+    # Initialize Minikube
+    start_minikube()
+
+    if args.build:
+        build_in_minikube()
+        mark_for_restart(docs)
+
+    # Load the kubeconfig once for all API calls
+    config.load_kube_config()
+    api_client = client.ApiClient()
+
     # Create namespace
-    create_namespace(namespace)
+    create_namespace(api_client, namespace)
 
-    # Apply deployment and service manifests
-    apply_kubernetes_manifest(deployment_manifest)
-    apply_kubernetes_manifest(service_manifest)
+    # Apply deployment and service manifests together
+    apply_kubernetes_manifests(api_client, docs, namespace)
 
     # Wait for the service to be up and check its status
-    if check_service_status("atlas-svc", namespace):
+    if check_service_status(api_client, "atlas-svc", namespace) and check_health(minikube_ip()):
         logger.info("Deployment successful, health checks passed.")
     else:
         logger.error("Health checks failed, check logs for details.")
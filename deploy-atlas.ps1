@@ -7,11 +7,8 @@ Write-Host "🐳 Building Docker image 'atlas-app:latest' inside Minikube..."
 docker build -t atlas-app:latest .
 
 # === Apply K8s manifests ===
-Write-Host "📦 Applying Kubernetes deployment..."
-kubectl apply -n atlas -f k8s/atlas-deployment.yaml
-
-Write-Host "🌐 Applying Kubernetes service..."
-kubectl apply -n atlas -f k8s/atlas-service-nodeport.yaml
+Write-Host "📦 Applying Kubernetes deployment and service..."
+kubectl apply -n atlas -f k8s/atlas-deployment.yaml -f k8s/atlas-service-nodeport.yaml
 
 # === Restart deployment to use new image ===
 Write-Host "🔁 Restarting deployment to load new image..."